@@ -1,9 +1,14 @@
-import json
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
 from datetime import datetime, timezone
 from pathlib import Path
 from uuid import uuid4
 
 import chromadb
+import numpy as np
+import orjson
 from chromadb.api.models.Collection import Collection
 
 from app.config import settings
@@ -13,8 +18,52 @@ def _now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
-def _dummy_embedding() -> list[float]:
-    return [0.0, 0.0, 0.0]
+def _encode_record(payload: dict) -> str:
+    # Chroma documents must be str; orjson's C encoder beats a hand-rolled per-schema
+    # f-string encoder for these small fixed-shape records.
+    return orjson.dumps(payload).decode()
+
+
+# Users, chats, messages and templates are only ever looked up by id or metadata filter,
+# so they share one placeholder vector. It must still be passed explicitly whenever a
+# document is written, otherwise Chroma embeds the document with its default model.
+_DUMMY_EMBEDDING = [0.0, 0.0, 0.0]
+
+
+def _lru_get(cache: OrderedDict, key: str):
+    value = cache.get(key)
+    if value is not None:
+        cache.move_to_end(key)
+    return value
+
+
+def _lru_put(cache: OrderedDict, key: str, value, max_items: int):
+    cache[key] = value
+    cache.move_to_end(key)
+    if len(cache) > max_items:
+        cache.popitem(last=False)
+
+
+DOCUMENT_BATCH_SIZE = 256
+# HNSW settings only take effect when the collection is first created; an existing
+# document collection keeps its original index configuration.
+DOCUMENT_INDEX_METADATA = {
+    "hnsw:space": "cosine",
+    "hnsw:construction_ef": 200,
+    "hnsw:M": 32,
+    "hnsw:batch_size": 1000,
+    "hnsw:sync_threshold": 10000,
+}
+
+
+@dataclass(frozen=True, slots=True)
+class RetrievalResult:
+    sources: tuple[str, ...] = ()
+    texts: tuple[str, ...] = ()
+    distances: tuple[float | None, ...] = ()
+
+    def __len__(self) -> int:
+        return len(self.sources)
 
 
 class ChromaStore:
@@ -26,10 +75,30 @@ class ChromaStore:
         self.users = self.client.get_or_create_collection(name=settings.chroma_users_collection)
         self.chats = self.client.get_or_create_collection(name=settings.chroma_chats_collection)
         self.messages = self.client.get_or_create_collection(name=settings.chroma_messages_collection)
-        self.documents = self.client.get_or_create_collection(name=settings.chroma_documents_collection)
+        self.documents = self.client.get_or_create_collection(
+            name=settings.chroma_documents_collection,
+            metadata=DOCUMENT_INDEX_METADATA,
+        )
         self.prompt_templates = self.client.get_or_create_collection(
             name=settings.chroma_prompt_templates_collection
         )
+        self._template_cache: dict[str, dict] | None = None
+
+        # Decoded user/chat/message records keyed by id, so hot request paths skip
+        # both the Chroma read and json.loads. Writes go through this store, which
+        # keeps the caches coherent. Lookups by username always read Chroma, since
+        # passwords can be reset from another process (scripts.seed_user).
+        # Each cache is an LRU capped at record_cache_max_items entries.
+        self._cache_lock = threading.Lock()
+        self._cache_max_items = settings.record_cache_max_items
+        self._user_by_id: OrderedDict[str, dict] = OrderedDict()
+        self._chat_by_id: OrderedDict[str, dict] = OrderedDict()
+        # (messages, complete): an incomplete entry holds only the newest messages, which
+        # still serves limited reads and is extended by add_message like a full one.
+        self._messages_by_chat: OrderedDict[str, tuple[list[dict], bool]] = OrderedDict()
+        # Chats whose messages are being read from Chroma outside the lock. add_message
+        # drops the marker, so a read that raced a write never caches its stale list.
+        self._messages_loading: dict[str, object] = {}
 
     def seed_prompt_templates(self):
         templates = [
@@ -61,16 +130,22 @@ class ChromaStore:
             },
         ]
 
-        existing = self.prompt_templates.get(include=[])
+        self._template_cache = None
+        existing = self.prompt_templates.get(include=["documents"])
         existing_ids = existing.get("ids") or []
-        if existing_ids:
-            self.prompt_templates.delete(ids=existing_ids)
+        desired = {item["id"]: item["template"] for item in templates}
+        if dict(zip(existing_ids, existing.get("documents") or [])) == desired:
+            return
+
+        stale_ids = [template_id for template_id in existing_ids if template_id not in desired]
+        if stale_ids:
+            self.prompt_templates.delete(ids=stale_ids)
 
-        self.prompt_templates.add(
+        self.prompt_templates.upsert(
             ids=[item["id"] for item in templates],
             documents=[item["template"] for item in templates],
             metadatas=[{"name": item["name"], "created_at": _now_iso()} for item in templates],
-            embeddings=[_dummy_embedding() for _ in templates],
+            embeddings=[_DUMMY_EMBEDDING] * len(templates),
         )
 
     def list_prompt_templates(self) -> list[dict]:
@@ -93,14 +168,10 @@ class ChromaStore:
     def get_prompt_template(self, template_id: str | None) -> dict | None:
         if not template_id:
             return None
-        data = self.prompt_templates.get(ids=[template_id], include=["documents", "metadatas"])
-        ids = data.get("ids") or []
-        if not ids:
-            return None
-
-        metadata = (data.get("metadatas") or [{}])[0] or {}
-        document = (data.get("documents") or [""])[0] or ""
-        return {"id": template_id, "name": metadata.get("name", "Template"), "template": document}
+        if self._template_cache is None:
+            self._template_cache = {item["id"]: item for item in self.list_prompt_templates()}
+        template = self._template_cache.get(template_id)
+        return dict(template) if template else None
 
     def create_user(self, username: str, password_hash: str, full_name: str | None = None) -> dict:
         existing = self.get_user_by_username(username)
@@ -117,10 +188,11 @@ class ChromaStore:
         }
         self.users.add(
             ids=[user_id],
-            documents=[json.dumps(payload)],
+            documents=[_encode_record(payload)],
             metadatas=[{"username": username}],
-            embeddings=[_dummy_embedding()],
+            embeddings=[_DUMMY_EMBEDDING],
         )
+        self._forget_user(user_id)
         return payload
 
     def update_user_password(self, username: str, password_hash: str) -> bool:
@@ -131,37 +203,94 @@ class ChromaStore:
         user["password_hash"] = password_hash
         self.users.update(
             ids=[user["id"]],
-            documents=[json.dumps(user)],
+            documents=[_encode_record(user)],
             metadatas=[{"username": user["username"]}],
-            embeddings=[_dummy_embedding()],
+            embeddings=[_DUMMY_EMBEDDING],
         )
+        self._forget_user(user["id"])
         return True
 
+    def _remember_user(self, user: dict) -> dict:
+        with self._cache_lock:
+            _lru_put(self._user_by_id, user["id"], user, self._cache_max_items)
+        return dict(user)
+
+    def _forget_user(self, user_id: str):
+        with self._cache_lock:
+            self._user_by_id.pop(user_id, None)
+
     def get_user_by_username(self, username: str) -> dict | None:
         data = self.users.get(where={"username": username}, include=["documents"])
         ids = data.get("ids") or []
         if not ids:
             return None
         doc = (data.get("documents") or ["{}"])[0]
-        return json.loads(doc)
+        return self._remember_user(orjson.loads(doc))
 
     def get_user_by_id(self, user_id: str) -> dict | None:
+        with self._cache_lock:
+            cached = _lru_get(self._user_by_id, user_id)
+        if cached is not None:
+            return dict(cached)
+
         data = self.users.get(ids=[user_id], include=["documents"])
         ids = data.get("ids") or []
         if not ids:
             return None
         doc = (data.get("documents") or ["{}"])[0]
-        return json.loads(doc)
+        return self._remember_user(orjson.loads(doc))
+
+    @staticmethod
+    def _chat_metadata(chat: dict) -> dict:
+        return {
+            "user_id": chat["user_id"],
+            "title": chat["title"],
+            "created_at": chat.get("created_at") or "",
+            "updated_at": chat.get("updated_at") or "",
+        }
+
+    @staticmethod
+    def _decode_chat(doc: str, metadata: dict | None) -> dict:
+        chat = orjson.loads(doc)
+        # Plain activity bumps only touch metadata, so it holds the freshest updated_at.
+        updated_at = (metadata or {}).get("updated_at")
+        if updated_at:
+            chat["updated_at"] = updated_at
+        return chat
 
     def list_chats(self, user_id: str) -> list[dict]:
-        data = self.chats.get(where={"user_id": user_id}, include=["documents"])
-        chats = [json.loads(doc) for doc in (data.get("documents") or [])]
-        chats.sort(key=lambda item: item.get("updated_at", ""), reverse=True)
+        data = self.chats.get(where={"user_id": user_id}, include=["metadatas"])
+        chats = []
+        legacy_ids = []
+        for chat_id, metadata in zip(data.get("ids") or [], data.get("metadatas") or []):
+            metadata = metadata or {}
+            if "title" not in metadata:
+                legacy_ids.append(chat_id)
+                continue
+            chats.append(
+                {
+                    "id": chat_id,
+                    "user_id": metadata["user_id"],
+                    "title": metadata["title"],
+                    "created_at": metadata.get("created_at"),
+                    "updated_at": metadata.get("updated_at"),
+                }
+            )
+
+        # Chats written before the title moved into metadata still need their document.
+        if legacy_ids:
+            legacy = self.chats.get(ids=legacy_ids, include=["documents", "metadatas"])
+            chats.extend(
+                self._decode_chat(doc, metadata)
+                for doc, metadata in zip(legacy.get("documents") or [], legacy.get("metadatas") or [])
+            )
+
+        chats.sort(key=lambda item: item.get("updated_at") or "", reverse=True)
         return chats
 
-    def create_chat(self, user_id: str, title: str = "New Chat") -> dict:
+    def create_chat(self, user_id: str, title: str = "New Chat", now: str | None = None) -> dict:
         chat_id = str(uuid4())
-        now = _now_iso()
+        now = now or _now_iso()
         payload = {
             "id": chat_id,
             "user_id": user_id,
@@ -171,26 +300,43 @@ class ChromaStore:
         }
         self.chats.add(
             ids=[chat_id],
-            documents=[json.dumps(payload)],
-            metadatas=[{"user_id": user_id}],
-            embeddings=[_dummy_embedding()],
+            documents=[_encode_record(payload)],
+            metadatas=[self._chat_metadata(payload)],
+            embeddings=[_DUMMY_EMBEDDING],
         )
+        with self._cache_lock:
+            self._chat_by_id.pop(chat_id, None)
+            self._messages_by_chat.pop(chat_id, None)
         return payload
 
     def get_chat(self, chat_id: str) -> dict | None:
-        data = self.chats.get(ids=[chat_id], include=["documents"])
+        with self._cache_lock:
+            cached = _lru_get(self._chat_by_id, chat_id)
+        if cached is not None:
+            return dict(cached)
+
+        data = self.chats.get(ids=[chat_id], include=["documents", "metadatas"])
         ids = data.get("ids") or []
         if not ids:
             return None
-        return json.loads((data.get("documents") or ["{}"])[0])
+        chat = self._decode_chat(
+            (data.get("documents") or ["{}"])[0],
+            (data.get("metadatas") or [{}])[0],
+        )
+        with self._cache_lock:
+            _lru_put(self._chat_by_id, chat_id, chat, self._cache_max_items)
+        return dict(chat)
 
-    def update_chat(self, chat: dict):
+    def update_chat(self, chat: dict, now: str | None = None):
+        chat["updated_at"] = now or _now_iso()
         self.chats.update(
             ids=[chat["id"]],
-            documents=[json.dumps(chat)],
-            metadatas=[{"user_id": chat["user_id"]}],
-            embeddings=[_dummy_embedding()],
+            documents=[_encode_record(chat)],
+            metadatas=[self._chat_metadata(chat)],
+            embeddings=[_DUMMY_EMBEDDING],
         )
+        with self._cache_lock:
+            self._chat_by_id.pop(chat["id"], None)
 
     def add_message(
         self,
@@ -200,8 +346,10 @@ class ChromaStore:
         content: str,
         prompt_template_id: str | None = None,
         sources: list[str] | None = None,
+        now: str | None = None,
     ) -> dict:
         message_id = str(uuid4())
+        now = now or _now_iso()
         payload = {
             "id": message_id,
             "chat_id": chat_id,
@@ -210,45 +358,135 @@ class ChromaStore:
             "content": content,
             "prompt_template_id": prompt_template_id,
             "sources": sources or [],
-            "created_at": _now_iso(),
+            "created_at": now,
         }
         self.messages.add(
             ids=[message_id],
-            documents=[json.dumps(payload)],
-            metadatas=[{"chat_id": chat_id, "user_id": user_id, "role": role}],
-            embeddings=[_dummy_embedding()],
+            documents=[_encode_record(payload)],
+            metadatas=[{"chat_id": chat_id, "user_id": user_id, "role": role, "created_at": now}],
+            embeddings=[_DUMMY_EMBEDDING],
         )
+        with self._cache_lock:
+            cached = self._messages_by_chat.get(chat_id)
+            if cached is not None:
+                cached[0].append(payload)
+            self._messages_loading.pop(chat_id, None)
 
         chat = self.get_chat(chat_id)
-        if chat:
-            chat["updated_at"] = _now_iso()
-            if chat.get("title") == "New Chat" and role == "user":
-                chat["title"] = (content[:60] + "...") if len(content) > 60 else content
-            self.update_chat(chat)
+        if not chat:
+            return payload
+
+        if chat.get("title") == "New Chat" and role == "user":
+            chat["title"] = (content[:60] + "...") if len(content) > 60 else content
+            self.update_chat(chat, now=now)
+        else:
+            # Only the timestamp moved: bump metadata and leave the stored document alone.
+            chat["updated_at"] = now
+            self.chats.update(ids=[chat_id], metadatas=[self._chat_metadata(chat)])
+            with self._cache_lock:
+                _lru_put(self._chat_by_id, chat_id, chat, self._cache_max_items)
 
         return payload
 
-    def list_messages(self, chat_id: str) -> list[dict]:
+    def list_messages(self, chat_id: str, limit: int | None = None) -> list[dict]:
+        with self._cache_lock:
+            cached = _lru_get(self._messages_by_chat, chat_id)
+            if cached is not None:
+                messages, complete = cached
+                if complete or (limit and len(messages) >= limit):
+                    return messages[-limit:] if limit else list(messages)
+            load_token = object()
+            self._messages_loading[chat_id] = load_token
+
+        if limit:
+            # Order by created_at metadata and decode only the newest `limit` documents.
+            index = self.messages.get(where={"chat_id": chat_id}, include=["metadatas"])
+            ids = index.get("ids") or []
+            metadatas = [metadata or {} for metadata in (index.get("metadatas") or [])]
+            if len(ids) > limit and all("created_at" in metadata for metadata in metadatas):
+                ordered = sorted(zip(ids, metadatas), key=lambda item: item[1]["created_at"])
+                data = self.messages.get(
+                    ids=[message_id for message_id, _ in ordered[-limit:]],
+                    include=["documents"],
+                )
+                messages = [orjson.loads(doc) for doc in (data.get("documents") or [])]
+                messages.sort(key=lambda item: item.get("created_at", ""))
+                with self._cache_lock:
+                    if self._messages_loading.get(chat_id) is load_token:
+                        del self._messages_loading[chat_id]
+                        _lru_put(self._messages_by_chat, chat_id, (messages, False), self._cache_max_items)
+                return list(messages)
+
         data = self.messages.get(where={"chat_id": chat_id}, include=["documents"])
-        messages = [json.loads(doc) for doc in (data.get("documents") or [])]
+        messages = [orjson.loads(doc) for doc in (data.get("documents") or [])]
         messages.sort(key=lambda item: item.get("created_at", ""))
-        return messages
-
-    def clear_documents(self):
-        existing = self.documents.get(include=[])
-        ids = existing.get("ids") or []
-        if ids:
-            self.documents.delete(ids=ids)
-
-    def add_document_chunk(self, source: str, chunk_text: str, embedding: list[float]):
-        self.documents.add(
-            ids=[str(uuid4())],
-            documents=[chunk_text],
-            metadatas=[{"source": source}],
-            embeddings=[embedding],
+        with self._cache_lock:
+            if self._messages_loading.get(chat_id) is load_token:
+                del self._messages_loading[chat_id]
+                _lru_put(self._messages_by_chat, chat_id, (messages, True), self._cache_max_items)
+        return messages[-limit:] if limit else list(messages)
+
+    def reset_documents(self):
+        # Dropping the collection (not just its rows) also resets the fixed vector size,
+        # so a changed embedding model or dimension can be ingested. Other processes
+        # holding the old collection (a running app) must be restarted afterwards.
+        self.client.delete_collection(name=settings.chroma_documents_collection)
+        self.documents = self.client.create_collection(
+            name=settings.chroma_documents_collection,
+            metadata=DOCUMENT_INDEX_METADATA,
         )
 
-    def query_document_chunks(self, query_embedding: list[float], top_k: int) -> list[dict]:
+    def document_sources(self) -> dict[str, dict]:
+        existing = self.documents.get(include=["metadatas"])
+        sources: dict[str, dict] = {}
+        for metadata in existing.get("metadatas") or []:
+            metadata = metadata or {}
+            source = metadata.get("source")
+            if source is None:
+                continue
+            entry = sources.setdefault(
+                source,
+                {"file_key": metadata.get("file_key"), "chunk_count": metadata.get("chunk_count"), "stored": 0},
+            )
+            # Chunks left over from different versions of a file mean it has to be rebuilt.
+            if entry["file_key"] != metadata.get("file_key"):
+                entry["file_key"] = None
+            entry["stored"] += 1
+        return sources
+
+    def delete_document_sources(self, sources: list[str]):
+        if sources:
+            self.documents.delete(where={"source": {"$in": sources}})
+
+    def add_document_chunks(
+        self,
+        sources: list[str],
+        chunk_texts: list[str],
+        embeddings: list[list[float]],
+        metadatas: list[dict] | None = None,
+        batch_size: int = DOCUMENT_BATCH_SIZE,
+    ):
+        # Content-addressed ids: a repeated (source, text) pair would make Chroma reject
+        # the whole batch, so only its first occurrence is kept.
+        rows = {}
+        for index, (source, chunk_text, embedding) in enumerate(zip(sources, chunk_texts, embeddings)):
+            chunk_id = f"{source}:{hashlib.sha1(chunk_text.encode('utf-8')).hexdigest()[:16]}"
+            metadata = {**metadatas[index], "source": source} if metadatas else {"source": source}
+            rows.setdefault(chunk_id, (chunk_text, embedding, metadata))
+
+        # Upsert so a re-run over a partially ingested file overwrites instead of failing.
+        ids = list(rows)
+        for start in range(0, len(ids), batch_size):
+            batch_ids = ids[start : start + batch_size]
+            batch = [rows[chunk_id] for chunk_id in batch_ids]
+            self.documents.upsert(
+                ids=batch_ids,
+                documents=[chunk_text for chunk_text, _, _ in batch],
+                metadatas=[metadata for _, _, metadata in batch],
+                embeddings=np.asarray([embedding for _, embedding, _ in batch], dtype=np.float32),
+            )
+
+    def query_document_chunks(self, query_embedding: list[float], top_k: int) -> RetrievalResult:
         result = self.documents.query(
             query_embeddings=[query_embedding],
             n_results=top_k,
@@ -259,16 +497,11 @@ class ChromaStore:
         metadatas = (result.get("metadatas") or [[]])[0]
         distances = (result.get("distances") or [[]])[0]
 
-        items = []
-        for doc, metadata, distance in zip(documents, metadatas, distances):
-            items.append(
-                {
-                    "source": (metadata or {}).get("source", "unknown.pdf"),
-                    "chunk_text": doc,
-                    "distance": float(distance) if distance is not None else None,
-                }
-            )
-        return items
+        return RetrievalResult(
+            sources=tuple((metadata or {}).get("source", "unknown.pdf") for metadata in metadatas),
+            texts=tuple(documents),
+            distances=tuple(float(distance) if distance is not None else None for distance in distances),
+        )
 
 
 store = ChromaStore()
@@ -15,6 +15,10 @@ class Settings(BaseSettings):
     openai_api_key: str = ""
     openai_chat_model: str = "gpt-4.1-mini"
     openai_embedding_model: str = "text-embedding-3-small"
+    openai_embedding_dimensions: int | None = None
+    embedding_cache_path: str = "./embedding_cache/embeddings.sqlite"
+    embedding_cache_memory_items: int = 4096
+    embedding_cache_dtype: str = "fp32"
 
     rag_top_k: int = 4
     chroma_persist_directory: str = "./chroma_data"
@@ -23,6 +27,7 @@ class Settings(BaseSettings):
     chroma_messages_collection: str = "messages"
     chroma_documents_collection: str = "document_chunks"
     chroma_prompt_templates_collection: str = "prompt_templates"
+    record_cache_max_items: int = 1024
 
     model_config = SettingsConfigDict(
         env_file=".env",
@@ -0,0 +1,96 @@
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+# SQLite caps bound parameters per statement; stay well under the default limit.
+_LOOKUP_BATCH_SIZE = 500
+EMBEDDING_DTYPES = ("fp32", "fp16", "int8")
+
+
+def quantize(vec: list[float], dtype: str) -> bytes:
+    arr = np.asarray(vec, dtype=np.float32)
+    if dtype == "fp16":
+        return arr.astype(np.float16).tobytes()
+    if dtype == "int8":
+        # Per-vector scale stored as a float32 prefix ahead of the int8 codes.
+        scale = float(np.abs(arr).max()) / 127 or 1.0
+        codes = np.clip(np.round(arr / scale), -127, 127).astype(np.int8)
+        return np.float32(scale).tobytes() + codes.tobytes()
+    return arr.tobytes()
+
+
+def dequantize(blob: bytes, dtype: str) -> np.ndarray:
+    if dtype == "fp16":
+        return np.frombuffer(blob, dtype=np.float16).astype(np.float32)
+    if dtype == "int8":
+        scale = np.frombuffer(blob, dtype=np.float32, count=1)[0]
+        return np.frombuffer(blob, dtype=np.int8, offset=4).astype(np.float32) * scale
+    return np.frombuffer(blob, dtype=np.float32).copy()
+
+
+class EmbeddingCache:
+    def __init__(self, path: str, model: str, memory_items: int = 4096, dtype: str = "fp32"):
+        if dtype not in EMBEDDING_DTYPES:
+            raise ValueError(f"Unsupported embedding cache dtype: {dtype}")
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.model = model
+        self.dtype = dtype
+        self.memory_items = memory_items
+        # float32 arrays rather than lists of Python floats, which cost ~8x the memory;
+        # they are converted back to lists only when handed to callers.
+        self._memory: OrderedDict[bytes, np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vec BLOB NOT NULL)")
+        self.conn.commit()
+
+    def key(self, text: str) -> bytes:
+        # The dtype is part of the key so switching it never decodes blobs in the wrong format.
+        return hashlib.blake2b(f"{self.model}\0{self.dtype}\0{text}".encode("utf-8"), digest_size=16).digest()
+
+    def _remember(self, key: bytes, vec: np.ndarray):
+        self._memory[key] = vec
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get_many(self, keys: list[bytes]) -> dict[bytes, list[float]]:
+        found = {}
+        with self._lock:
+            for key in keys:
+                vec = self._memory.get(key)
+                if vec is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vec.tolist()
+
+            missing = list({key for key in keys if key not in found})
+            for start in range(0, len(missing), _LOOKUP_BATCH_SIZE):
+                batch = missing[start : start + _LOOKUP_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT key, vec FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    vec = dequantize(blob, self.dtype)
+                    found[key] = vec.tolist()
+                    self._remember(key, vec)
+        return found
+
+    def put_many(self, items: list[tuple[bytes, list[float]]]) -> list[list[float]]:
+        # Returns the vectors as stored, so a miss hands callers exactly what later hits will.
+        if not items:
+            return []
+        rows = [(key, quantize(vec, self.dtype)) for key, vec in items]
+        stored = []
+        with self._lock:
+            self.conn.executemany("INSERT OR IGNORE INTO embeddings (key, vec) VALUES (?, ?)", rows)
+            self.conn.commit()
+            for key, blob in rows:
+                vec = dequantize(blob, self.dtype)
+                self._remember(key, vec)
+                stored.append(vec.tolist())
+        return stored
@@ -1,12 +1,15 @@
+import asyncio
+from collections.abc import AsyncIterator
 from pathlib import Path
 
-from fastapi import FastAPI, Form, HTTPException, Request
-from fastapi.responses import HTMLResponse, RedirectResponse
+import orjson
+from fastapi import FastAPI, Form, HTTPException, Query, Request
+from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from starlette.middleware.sessions import SessionMiddleware
 
-from app.chroma_store import store
+from app.chroma_store import _now_iso, store
 from app.config import settings
 from app.rag import RAGService
 from app.security import verify_password
@@ -24,18 +27,35 @@ try:
 except Exception:
     rag_service = None
 
+_SEEDED = False
+HISTORY_LIMIT = 20
+# Strong references to replies still being finished after their client disconnected.
+_background_tasks: set[asyncio.Task] = set()
+
 
 @app.on_event("startup")
 def startup_event():
+    global _SEEDED
+    if _SEEDED:
+        return
     store.seed_prompt_templates()
+    _SEEDED = True
+
+
+def _sse_event(payload: dict) -> str:
+    return f"data: {orjson.dumps(payload).decode()}\n\n"
+
+
+async def _single_part(text: str) -> AsyncIterator[str]:
+    yield text
 
 
-def get_current_user(request: Request) -> dict:
+async def get_current_user(request: Request) -> dict:
     user_id = request.session.get("user_id")
     if not user_id:
         raise HTTPException(status_code=401, detail="Not authenticated")
 
-    user = store.get_user_by_id(user_id)
+    user = await asyncio.to_thread(store.get_user_by_id, user_id)
     if not user:
         raise HTTPException(status_code=401, detail="Invalid session")
     return user
@@ -61,13 +81,13 @@ def chat_page(request: Request):
 
 
 @app.post("/api/login")
-def login(
+async def login(
     request: Request,
     username: str = Form(...),
     password: str = Form(...),
 ):
-    user = store.get_user_by_username(username)
-    if not user or not verify_password(password, user["password_hash"]):
+    user = await asyncio.to_thread(store.get_user_by_username, username)
+    if not user or not await asyncio.to_thread(verify_password, password, user["password_hash"]):
         raise HTTPException(status_code=401, detail="Invalid username or password")
 
     request.session["user_id"] = user["id"]
@@ -81,9 +101,9 @@ def logout(request: Request):
 
 
 @app.get("/api/chats")
-def list_chats(request: Request):
-    user = get_current_user(request)
-    chats = store.list_chats(user_id=user["id"])
+async def list_chats(request: Request):
+    user = await get_current_user(request)
+    chats = await asyncio.to_thread(store.list_chats, user_id=user["id"])
     return [
         {
             "id": c["id"],
@@ -96,20 +116,20 @@ def list_chats(request: Request):
 
 
 @app.post("/api/chats")
-def create_chat(request: Request):
-    user = get_current_user(request)
-    chat = store.create_chat(user_id=user["id"], title="New Chat")
+async def create_chat(request: Request):
+    user = await get_current_user(request)
+    chat = await asyncio.to_thread(store.create_chat, user_id=user["id"], title="New Chat")
     return {"id": chat["id"], "title": chat["title"]}
 
 
 @app.get("/api/chats/{chat_id}/messages")
-def get_messages(chat_id: str, request: Request):
-    user = get_current_user(request)
-    chat = store.get_chat(chat_id)
+async def get_messages(chat_id: str, request: Request, limit: int = Query(default=50, ge=1, le=500)):
+    user = await get_current_user(request)
+    chat = await asyncio.to_thread(store.get_chat, chat_id)
     if not chat or chat.get("user_id") != user["id"]:
         raise HTTPException(status_code=404, detail="Chat not found")
 
-    messages = store.list_messages(chat_id=chat_id)
+    messages = await asyncio.to_thread(store.list_messages, chat_id=chat_id, limit=limit)
     return [
         {
             "id": m["id"],
@@ -124,7 +144,8 @@ def get_messages(chat_id: str, request: Request):
 
 @app.post("/api/chats/{chat_id}/messages")
 async def send_message(chat_id: str, request: Request):
-    user = get_current_user(request)
+    now = _now_iso()
+    user = await get_current_user(request)
     data = await request.json()
     user_message = (data.get("message") or "").strip()
     prompt_template_id = (data.get("prompt_template_id") or "").strip() or None
@@ -135,36 +156,86 @@ async def send_message(chat_id: str, request: Request):
     if rag_service is None:
         raise HTTPException(status_code=500, detail="OPENAI_API_KEY is not configured")
 
-    chat = store.get_chat(chat_id)
+    chat = await asyncio.to_thread(store.get_chat, chat_id)
     if not chat or chat.get("user_id") != user["id"]:
         raise HTTPException(status_code=404, detail="Chat not found")
 
-    store.add_message(chat_id=chat_id, user_id=user["id"], role="user", content=user_message)
-    prior_messages = store.list_messages(chat_id=chat_id)
-    history = [{"role": m["role"], "content": m["content"]} for m in prior_messages[:-1]]
+    prior_messages = await asyncio.to_thread(store.list_messages, chat_id=chat_id, limit=HISTORY_LIMIT)
+    history = [{"role": m["role"], "content": m["content"]} for m in prior_messages]
+    await asyncio.to_thread(
+        store.add_message, chat_id=chat_id, user_id=user["id"], role="user", content=user_message, now=now
+    )
 
-    prompt_template = store.get_prompt_template(prompt_template_id)
-    query_embedding = rag_service.embed_text(user_message)
-    context_chunks = rag_service.find_relevant_chunks(query_embedding)
+    query_embedding = await rag_service.embed_text_async(user_message)
+    context_chunks = await asyncio.to_thread(rag_service.find_relevant_chunks, query_embedding)
     if not context_chunks:
-        assistant_text = "I can only answer from the provided PDF documents."
+        answer_parts = _single_part("I can only answer from the provided PDF documents.")
     else:
-        assistant_text = rag_service.generate_answer(
+        prompt_template = await asyncio.to_thread(store.get_prompt_template, prompt_template_id)
+        answer_parts = rag_service.generate_answer_stream_async(
             user_message=user_message,
             context_chunks=context_chunks,
             history=history,
             prompt_template=prompt_template["template"] if prompt_template else None,
         )
 
-    sources = sorted({item["source"] for item in context_chunks})
-    store.add_message(
-        chat_id=chat_id,
-        user_id=user["id"],
-        role="assistant",
-        content=assistant_text,
-        prompt_template_id=prompt_template_id,
-        sources=sources,
-    )
+    sources = list(dict.fromkeys(context_chunks.sources))
+
+    def save_assistant_message(assistant_text: str, finished_at: str):
+        store.add_message(
+            chat_id=chat_id,
+            user_id=user["id"],
+            role="assistant",
+            content=assistant_text,
+            prompt_template_id=prompt_template_id,
+            sources=sources,
+            now=finished_at,
+        )
+
+    if "text/event-stream" in request.headers.get("accept", ""):
+        # Wait for the first part before the response starts, so a failed model call
+        # still comes back as an error status instead of an empty 200 stream.
+        first_part = await anext(answer_parts, None)
+        streamed_parts: list[str] = []
+
+        async def finish_reply():
+            try:
+                async for delta in answer_parts:
+                    streamed_parts.append(delta)
+            finally:
+                await asyncio.to_thread(save_assistant_message, "".join(streamed_parts), _now_iso())
+
+        async def event_stream():
+            finished = False
+            try:
+                if first_part is not None:
+                    streamed_parts.append(first_part)
+                    yield _sse_event({"delta": first_part})
+                async for delta in answer_parts:
+                    streamed_parts.append(delta)
+                    yield _sse_event({"delta": delta})
+                finished = True
+            except Exception as error:
+                finished = True
+                print(f"Streaming answer for chat {chat_id} failed: {error}")
+                yield _sse_event({"error": "The answer could not be completed. Please try again."})
+                return
+            finally:
+                if not finished:
+                    # The client went away mid-stream; finish and save the reply anyway.
+                    task = asyncio.get_running_loop().create_task(finish_reply())
+                    _background_tasks.add(task)
+                    task.add_done_callback(_background_tasks.discard)
+            # Persist before the done frame, stamped when generation finished, so a
+            # quick follow-up already sees this reply in its history and sorts after it.
+            assistant_text = "".join(streamed_parts)
+            await asyncio.to_thread(save_assistant_message, assistant_text, _now_iso())
+            yield _sse_event({"done": True, "content": assistant_text, "sources": sources})
+
+        return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+    assistant_text = "".join([part async for part in answer_parts])
+    await asyncio.to_thread(save_assistant_message, assistant_text, _now_iso())
 
     return {
         "user_message": {"role": "user", "content": user_message},
@@ -177,6 +248,6 @@ async def send_message(chat_id: str, request: Request):
 
 
 @app.get("/api/prompt-templates")
-def list_prompt_templates(request: Request):
-    get_current_user(request)
-    return store.list_prompt_templates()
+async def list_prompt_templates(request: Request):
+    await get_current_user(request)
+    return await asyncio.to_thread(store.list_prompt_templates)
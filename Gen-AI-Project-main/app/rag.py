@@ -1,7 +1,14 @@
-from openai import OpenAI
+import asyncio
+from collections.abc import AsyncIterator, Iterator
 
-from app.chroma_store import store
+from openai import AsyncOpenAI, OpenAI
+
+from app.chroma_store import RetrievalResult, store
 from app.config import settings
+from app.embedding_cache import EmbeddingCache
+
+# The embeddings endpoint rejects requests with more inputs than this.
+EMBEDDING_REQUEST_MAX_INPUTS = 2048
 
 
 class RAGService:
@@ -9,26 +16,77 @@ class RAGService:
         if not settings.openai_api_key:
             raise ValueError("OPENAI_API_KEY is not configured")
         self.client = OpenAI(api_key=settings.openai_api_key)
+        self.async_client = AsyncOpenAI(api_key=settings.openai_api_key)
+        # text-embedding-3 models can return shortened vectors. The signature is stored
+        # with every ingested chunk, and a change makes the next ingest rebuild the
+        # document collection, whose vector size is fixed by its first insert.
+        self.embedding_options = {"model": settings.openai_embedding_model}
+        if settings.openai_embedding_dimensions:
+            self.embedding_options["dimensions"] = settings.openai_embedding_dimensions
+        self.embedding_signature = (
+            f"{settings.openai_embedding_model}:{settings.openai_embedding_dimensions or 'default'}"
+        )
+        self.embedding_cache = EmbeddingCache(
+            settings.embedding_cache_path,
+            self.embedding_signature,
+            memory_items=settings.embedding_cache_memory_items,
+            dtype=settings.embedding_cache_dtype,
+        )
 
     def embed_text(self, text: str) -> list[float]:
-        response = self.client.embeddings.create(
-            model=settings.openai_embedding_model,
+        return self.embed_texts([text])[0]
+
+    async def embed_text_async(self, text: str) -> list[float]:
+        key = self.embedding_cache.key(text)
+        cached = await asyncio.to_thread(self.embedding_cache.get_many, [key])
+        if key in cached:
+            return cached[key]
+
+        response = await self.async_client.embeddings.create(
+            **self.embedding_options,
             input=text,
         )
-        return response.data[0].embedding
+        stored = await asyncio.to_thread(
+            self.embedding_cache.put_many, [(key, response.data[0].embedding)]
+        )
+        return stored[0]
+
+    def embed_texts(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        keys = [self.embedding_cache.key(text) for text in texts]
+        embeddings = self.embedding_cache.get_many(keys)
+
+        missing = {key: text for key, text in zip(keys, texts) if key not in embeddings}
+        missing_keys = list(missing)
+        for start in range(0, len(missing_keys), EMBEDDING_REQUEST_MAX_INPUTS):
+            batch_keys = missing_keys[start : start + EMBEDDING_REQUEST_MAX_INPUTS]
+            response = self.client.embeddings.create(
+                **self.embedding_options,
+                input=[missing[key] for key in batch_keys],
+            )
+            fresh = list(
+                zip(batch_keys, [item.embedding for item in sorted(response.data, key=lambda item: item.index)])
+            )
+            embeddings.update(zip(batch_keys, self.embedding_cache.put_many(fresh)))
 
-    def find_relevant_chunks(self, query_embedding: list[float]) -> list[dict]:
+        return [embeddings[key] for key in keys]
+
+    def find_relevant_chunks(self, query_embedding: list[float]) -> RetrievalResult:
         return store.query_document_chunks(query_embedding=query_embedding, top_k=settings.rag_top_k)
 
-    def generate_answer(
-        self,
+    @staticmethod
+    def _build_messages(
         user_message: str,
-        context_chunks: list[dict],
+        context_chunks: RetrievalResult,
         history: list[dict],
         prompt_template: str | None = None,
-    ) -> str:
+    ) -> list[dict]:
         context = "\n\n".join(
-            [f"Source: {chunk['source']}\n{chunk['chunk_text']}" for chunk in context_chunks]
+            [
+                f"Source: {source}\n{text}"
+                for source, text in zip(context_chunks.sources, context_chunks.texts)
+            ]
         )
         system_prompt = (
             "You are a professional call-center support chatbot. "
@@ -56,9 +114,76 @@ class RAGService:
             }
         )
 
+        return messages
+
+    def generate_answer(
+        self,
+        user_message: str,
+        context_chunks: RetrievalResult,
+        history: list[dict],
+        prompt_template: str | None = None,
+    ) -> str:
         response = self.client.chat.completions.create(
             model=settings.openai_chat_model,
-            messages=messages,
+            messages=self._build_messages(user_message, context_chunks, history, prompt_template),
+            temperature=0.2,
+        )
+        return response.choices[0].message.content or "I could not generate a response."
+
+    def generate_answer_stream(
+        self,
+        user_message: str,
+        context_chunks: RetrievalResult,
+        history: list[dict],
+        prompt_template: str | None = None,
+    ) -> Iterator[str]:
+        stream = self.client.chat.completions.create(
+            model=settings.openai_chat_model,
+            messages=self._build_messages(user_message, context_chunks, history, prompt_template),
+            temperature=0.2,
+            stream=True,
+        )
+        produced = False
+        for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                produced = True
+                yield delta
+        if not produced:
+            yield "I could not generate a response."
+
+    async def generate_answer_async(
+        self,
+        user_message: str,
+        context_chunks: RetrievalResult,
+        history: list[dict],
+        prompt_template: str | None = None,
+    ) -> str:
+        response = await self.async_client.chat.completions.create(
+            model=settings.openai_chat_model,
+            messages=self._build_messages(user_message, context_chunks, history, prompt_template),
             temperature=0.2,
         )
         return response.choices[0].message.content or "I could not generate a response."
+
+    async def generate_answer_stream_async(
+        self,
+        user_message: str,
+        context_chunks: RetrievalResult,
+        history: list[dict],
+        prompt_template: str | None = None,
+    ) -> AsyncIterator[str]:
+        stream = await self.async_client.chat.completions.create(
+            model=settings.openai_chat_model,
+            messages=self._build_messages(user_message, context_chunks, history, prompt_template),
+            temperature=0.2,
+            stream=True,
+        )
+        produced = False
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                produced = True
+                yield delta
+        if not produced:
+            yield "I could not generate a response."
@@ -1,48 +1,141 @@
+import asyncio
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import TYPE_CHECKING
 
-from pypdf import PdfReader
+from scripts.pdf_extract import extract_pdf_chunks
 
-from app.chroma_store import store
-from app.rag import RAGService
+# Under spawn/forkserver every pool worker re-imports this module as __mp_main__, so
+# the app modules (whose import opens the Chroma client) are imported inside functions.
+if TYPE_CHECKING:
+    from app.rag import RAGService
 
+EMBED_BATCH_SIZE = 128
+PIPELINE_QUEUE_SIZE = 4
+# Files submitted to the process pool but not yet handed to the embedder, whether
+# still parsing or finished and waiting; caps how much extracted text can pile up.
+MAX_IN_FLIGHT_FILES = 32
 
-def split_text(text: str, chunk_size: int = 1000, overlap: int = 150) -> list[str]:
-    chunks = []
-    start = 0
-    text = text.strip()
-    while start < len(text):
-        end = min(start + chunk_size, len(text))
-        chunks.append(text[start:end])
-        if end == len(text):
-            break
-        start = max(0, end - overlap)
-    return [chunk for chunk in chunks if chunk.strip()]
 
+def _file_key(path: Path, embedding_signature: str) -> str:
+    stat = path.stat()
+    return f"{embedding_signature}|{stat.st_size}:{stat.st_mtime_ns}"
+
+
+async def _run_pipeline(data_dir: Path, file_keys: dict[str, str], rag: "RAGService") -> dict:
+    from app.chroma_store import store
+
+    # extract -> embed -> store, each stage a task joined by bounded queues. Paths are
+    # fed to the pool lazily (at most MAX_IN_FLIGHT_FILES at once), so a slow stage
+    # throttles extraction instead of letting parsed files pile up.
+    loop = asyncio.get_running_loop()
+    embed_queue: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    write_queue: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    stats = {"chunks": 0, "duplicates": 0, "empty_pages": 0}
+
+    async def extract():
+        batch: list[tuple[str, str, dict]] = []
+        paths = iter(file_keys)
+        max_workers = max(1, min(os.cpu_count() or 1, len(file_keys), MAX_IN_FLIGHT_FILES))
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            in_flight = {
+                loop.run_in_executor(executor, extract_pdf_chunks, path)
+                for path in itertools.islice(paths, MAX_IN_FLIGHT_FILES)
+            }
+            while in_flight:
+                done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    path, chunks, empty_pages = future.result()
+                    stats["empty_pages"] += empty_pages
+                    # Repeated boilerplate (headers, footers) is stored once per file. Deduping
+                    # within a file keeps each file's chunks independent of every other file.
+                    unique_chunks = list(dict.fromkeys(chunks))
+                    stats["duplicates"] += len(chunks) - len(unique_chunks)
+                    stats["chunks"] += len(unique_chunks)
+
+                    source = str(Path(path).relative_to(data_dir.parent))
+                    metadata = {"file_key": file_keys[path], "chunk_count": len(unique_chunks)}
+                    for chunk in unique_chunks:
+                        batch.append((source, chunk, metadata))
+                        if len(batch) >= EMBED_BATCH_SIZE:
+                            await embed_queue.put(batch)
+                            batch = []
+
+                    # Only replace a file once its chunks have been queued downstream.
+                    next_path = next(paths, None)
+                    if next_path is not None:
+                        in_flight.add(loop.run_in_executor(executor, extract_pdf_chunks, next_path))
+        if batch:
+            await embed_queue.put(batch)
+        await embed_queue.put(None)
+
+    async def embed():
+        while (batch := await embed_queue.get()) is not None:
+            sources = [source for source, _, _ in batch]
+            chunk_texts = [chunk for _, chunk, _ in batch]
+            metadatas = [metadata for _, _, metadata in batch]
+            embeddings = await asyncio.to_thread(rag.embed_texts, chunk_texts)
+            await write_queue.put((sources, chunk_texts, embeddings, metadatas))
+        await write_queue.put(None)
+
+    async def write():
+        # The only stage that touches Chroma, so inserts never interleave.
+        while (item := await write_queue.get()) is not None:
+            await asyncio.to_thread(store.add_document_chunks, *item)
+
+    await asyncio.gather(extract(), embed(), write())
+    return stats
+
+
+def ingest_directory(data_dir: Path, full: bool = False):
+    from app.chroma_store import store
+    from app.rag import RAGService
 
-def ingest_directory(data_dir: Path):
     rag = RAGService()
-    store.clear_documents()
+    indexed = {} if full else store.document_sources()
+    signature_prefix = f"{rag.embedding_signature}|"
+    if not full and any(
+        entry["file_key"] is not None and not entry["file_key"].startswith(signature_prefix)
+        for entry in indexed.values()
+    ):
+        print(f"Embedding settings changed to {rag.embedding_signature}; rebuilding the document index.")
+        full = True
+        indexed = {}
+    if full:
+        store.reset_documents()
 
     files = [p for p in data_dir.rglob("*") if p.is_file() and p.suffix.lower() == ".pdf"]
-    total_chunks = 0
+    sources = {str(p.relative_to(data_dir.parent)): p for p in files}
 
-    for file_path in files:
-        reader = PdfReader(str(file_path))
-        pages = [page.extract_text() or "" for page in reader.pages]
-        text = "\n".join([page.strip() for page in pages if page.strip()])
-        if not text.strip():
+    # A file is unchanged when its embedding settings, size and mtime match and all
+    # of its chunks made it in.
+    removed = [source for source in indexed if source not in sources]
+    stale = []
+    file_keys: dict[str, str] = {}
+    for source, path in sources.items():
+        file_key = _file_key(path, rag.embedding_signature)
+        entry = indexed.get(source)
+        if entry and entry["file_key"] == file_key and entry["stored"] == entry["chunk_count"]:
             continue
+        if entry:
+            stale.append(source)
+        file_keys[str(path)] = file_key
 
-        for chunk in split_text(text):
-            emb = rag.embed_text(chunk)
-            store.add_document_chunk(
-                source=str(file_path.relative_to(data_dir.parent)),
-                chunk_text=chunk,
-                embedding=emb,
-            )
-            total_chunks += 1
+    store.delete_document_sources(removed + stale)
+    stats = {"chunks": 0, "duplicates": 0, "empty_pages": 0}
+    if file_keys:
+        stats = asyncio.run(_run_pipeline(data_dir, file_keys, rag))
 
-    print(f"Ingestion complete. Indexed {len(files)} PDF files and {total_chunks} chunks.")
+    print(
+        f"Ingestion complete. Indexed {len(file_keys)} changed PDF files and {stats['chunks']} chunks; "
+        f"{len(files) - len(file_keys)} unchanged, {len(removed)} removed."
+    )
+    if stats["duplicates"]:
+        print(f"Skipped {stats['duplicates']} duplicate chunks.")
+    if stats["empty_pages"]:
+        print(f"Skipped {stats['empty_pages']} pages with no extractable text.")
 
 
 if __name__ == "__main__":
@@ -50,6 +143,7 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description="Ingest PDF files from data directory into ChromaDB.")
     parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--full", action="store_true", help="Drop the document collection and re-ingest every file.")
     args = parser.parse_args()
 
-    ingest_directory(Path(args.data_dir).resolve())
+    ingest_directory(Path(args.data_dir).resolve(), full=args.full)
@@ -0,0 +1,63 @@
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+
+import pypdfium2 as pdfium
+
+
+def _nonempty(pages: Iterable[str]) -> Iterator[str]:
+    for page in pages:
+        page = page.strip()
+        if page:
+            yield page
+
+
+def iter_chunks(pages: Iterable[str], chunk_size: int = 1000, overlap: int = 150) -> Iterator[str]:
+    step = chunk_size - overlap
+    if step <= 0:
+        raise ValueError("overlap must be smaller than chunk_size")
+
+    buffer = ""
+    for page in _nonempty(pages):
+        buffer = f"{buffer}\n{page}" if buffer else page
+        # Walk an offset through the buffer and trim it once per page; trimming per
+        # window would copy the rest of a long page for every chunk.
+        start = 0
+        # Only emit once more text follows the window, so the last chunk runs to the end.
+        while len(buffer) - start > chunk_size:
+            chunk = buffer[start : start + chunk_size]
+            if not chunk.isspace():
+                yield chunk
+            start += step
+        buffer = buffer[start:]
+
+    if buffer and not buffer.isspace():
+        yield buffer
+
+
+# Kept free of app imports: pool workers import this module (and, under spawn, the
+# main module too), and importing app.chroma_store opens a Chroma client.
+def extract_pdf_chunks(path: str) -> tuple[str, list[str], int]:
+    # One sequential read, then parse from memory, instead of PDFium issuing many small reads.
+    pdf = pdfium.PdfDocument(Path(path).read_bytes())
+    empty_pages = 0
+
+    def page_texts() -> Iterator[str]:
+        nonlocal empty_pages
+        for index in range(len(pdf)):
+            page = pdf[index]
+            textpage = page.get_textpage()
+            try:
+                text = textpage.get_text_bounded()
+            finally:
+                textpage.close()
+                page.close()
+            # iter_chunks does the only strip; isspace() stops at the first visible character.
+            if text and not text.isspace():
+                yield text.replace("\r\n", "\n")
+            else:
+                empty_pages += 1
+
+    try:
+        return path, list(iter_chunks(page_texts())), empty_pages
+    finally:
+        pdf.close()
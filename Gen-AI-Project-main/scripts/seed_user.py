@@ -1,22 +1,59 @@
+from collections.abc import Callable
+
 from app.chroma_store import store
 from app.security import hash_password
 
 
-def seed_user(username: str, password: str, full_name: str | None = None, update_if_exists: bool = False):
+def _seed_user(username: str, full_name: str | None, update_if_exists: bool, make_hash: Callable[[], str]):
     existing = store.get_user_by_username(username)
     if existing and not update_if_exists:
         print(f"User '{username}' already exists.")
         return
 
+    # Hashing is deliberately slow, so it only happens once we know it is needed.
+    password_hash = make_hash()
+
     if existing and update_if_exists:
-        store.update_user_password(username=username, password_hash=hash_password(password))
+        store.update_user_password(username=username, password_hash=password_hash)
         print(f"User '{username}' password updated.")
         return
 
-    store.create_user(username=username, password_hash=hash_password(password), full_name=full_name)
+    store.create_user(username=username, password_hash=password_hash, full_name=full_name)
     print(f"User '{username}' created.")
 
 
+def seed_user(
+    username: str,
+    password: str | None = None,
+    full_name: str | None = None,
+    update_if_exists: bool = False,
+    *,
+    password_hash: str | None = None,
+):
+    if password is None and password_hash is None:
+        raise ValueError("Either password or password_hash is required")
+
+    _seed_user(username, full_name, update_if_exists, lambda: password_hash or hash_password(password))
+
+
+def seed_users(rows: list[dict]):
+    # Rows sharing a password share one hash, computed only if some row writes it.
+    hashes: dict[str, str] = {}
+
+    def make_hash(password: str) -> str:
+        if password not in hashes:
+            hashes[password] = hash_password(password)
+        return hashes[password]
+
+    for row in rows:
+        _seed_user(
+            row["username"],
+            row.get("full_name"),
+            row.get("update_if_exists", False),
+            lambda password=row["password"]: make_hash(password),
+        )
+
+
 if __name__ == "__main__":
     import argparse
 
@@ -103,7 +103,7 @@ function ChatApp() {
 
     const response = await fetch(`/api/chats/${chatId}/messages`, {
       method: "POST",
-      headers: { "Content-Type": "application/json" },
+      headers: { "Content-Type": "application/json", Accept: "text/event-stream" },
       body: JSON.stringify({
         message: text,
         prompt_template_id: selectedTemplate || null,
@@ -118,25 +118,55 @@ function ChatApp() {
       return;
     }
 
-    const payload = await response.json();
-    setMessages((prev) => [
-      ...prev.filter((item) => item.id !== optimisticUserMessage.id),
-      {
-        id: `u-${Date.now()}`,
-        role: "user",
-        content: payload.user_message.content,
-        sources: [],
-      },
-      {
-        id: `a-${Date.now()}`,
-        role: "assistant",
-        content: payload.assistant_message.content,
-        sources: payload.assistant_message.sources || [],
-      },
-    ]);
+    const assistantId = `a-${Date.now()}`;
+    setMessages((prev) => [...prev, { id: assistantId, role: "assistant", content: "", sources: [] }]);
 
-    await loadChats();
-    setSending(false);
+    let finished = false;
+    const applyEvent = (event) => {
+      if (event.error) {
+        throw new Error(event.error);
+      }
+      if (event.done) {
+        finished = true;
+      }
+      setMessages((prev) =>
+        prev.map((item) => {
+          if (item.id !== assistantId) {
+            return item;
+          }
+          if (event.done) {
+            return { ...item, content: event.content, sources: event.sources || [] };
+          }
+          return { ...item, content: item.content + event.delta };
+        })
+      );
+    };
+
+    try {
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) {
+          break;
+        }
+        buffer += decoder.decode(value, { stream: true });
+        const frames = buffer.split("\n\n");
+        buffer = frames.pop();
+        frames
+          .filter((frame) => frame.startsWith("data: "))
+          .forEach((frame) => applyEvent(JSON.parse(frame.slice("data: ".length))));
+      }
+      if (!finished) {
+        throw new Error("The response ended before the answer was complete.");
+      }
+      await loadChats();
+    } catch (streamError) {
+      setError(streamError.message || "Failed to receive the answer");
+    } finally {
+      setSending(false);
+    }
   };
 
   const logout = async () => {
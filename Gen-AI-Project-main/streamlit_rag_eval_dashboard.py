@@ -1,6 +1,6 @@
-import json
 from pathlib import Path
 
+import orjson
 import pandas as pd
 import streamlit as st
 
@@ -8,6 +8,42 @@ from scripts.evaluate_rag import evaluate_and_save
 
 REPORT_PATH = Path("eval/rag_eval_report.json")
 GROUND_TRUTH_PATH = Path("eval/ground_truth_rag.json")
+METRIC_CATEGORY_COLUMNS = ("metric_label", "unit", "category")
+QUESTION_CATEGORY_COLUMNS = ("expected_source", "top_source")
+QUESTION_FLAG_COLUMNS = ("hit_at_1", "hit_at_3", "hit_at_4", "answer_non_empty", "is_refusal", "is_grounded")
+
+
+def _format_count(value: float) -> str:
+    return f"{value:,.2f}" if float(value) % 1 else f"{int(value):,}"
+
+
+_METRIC_FORMATTERS = {
+    "ms": "{:,.2f} ms".format,
+    "ratio": "{:.3f}".format,
+}
+
+
+# mtime is unused in the body; it keys the cache so a rewritten report is re-read.
+@st.cache_data(show_spinner=False)
+def load_report(path: str, mtime: float) -> tuple[pd.DataFrame, pd.DataFrame]:
+    report = orjson.loads(Path(path).read_bytes())
+    metrics_df = pd.DataFrame(report.get("metrics", []))
+    questions_df = pd.DataFrame(report.get("per_question", []))
+
+    for column in METRIC_CATEGORY_COLUMNS:
+        if column in metrics_df:
+            metrics_df[column] = metrics_df[column].astype("category")
+    for column in QUESTION_CATEGORY_COLUMNS:
+        if column in questions_df:
+            questions_df[column] = questions_df[column].astype("category")
+    for column in QUESTION_FLAG_COLUMNS:
+        if column in questions_df:
+            questions_df[column] = pd.to_numeric(questions_df[column], downcast="integer")
+    if "source_rank" in questions_df:
+        # Nullable, since questions whose source was never retrieved have no rank.
+        questions_df["source_rank"] = questions_df["source_rank"].astype("Int16")
+
+    return metrics_df, questions_df
 
 
 st.set_page_config(page_title="RAG Evaluation Dashboard", layout="wide")
@@ -26,6 +62,7 @@ with col2:
 with col3:
     st.write("")
     run_eval = st.button("Run RAG Evaluation", type="primary", use_container_width=True)
+    reuse_retrievals = st.checkbox("Reuse cached retrievals (faster; retrieval latency may read n/a)", value=False)
 
 if run_eval:
     with st.spinner("Running evaluation across ground truth set..."):
@@ -35,6 +72,7 @@ if run_eval:
                 output_path=REPORT_PATH,
                 top_k=int(top_k),
                 prompt_template_id=prompt_template_id,
+                use_retrieval_cache=reuse_retrievals,
             )
             st.success(f"Evaluation complete. Published {report.get('total_metrics', 0)} metrics.")
         except Exception as error:
@@ -44,11 +82,7 @@ if not REPORT_PATH.exists():
     st.info("No report found yet. Click 'Run RAG Evaluation' to generate metrics.")
     st.stop()
 
-with REPORT_PATH.open("r", encoding="utf-8") as handle:
-    report = json.load(handle)
-
-metrics_df = pd.DataFrame(report.get("metrics", []))
-questions_df = pd.DataFrame(report.get("per_question", []))
+metrics_df, questions_df = load_report(str(REPORT_PATH), REPORT_PATH.stat().st_mtime)
 
 if metrics_df.empty:
     st.warning("Metrics are empty. Re-run evaluation.")
@@ -56,23 +90,16 @@ if metrics_df.empty:
 
 st.subheader("Published Metrics (20)")
 card_columns = st.columns(4)
-for index, (_, row) in enumerate(metrics_df.iterrows()):
-    column = card_columns[index % 4]
-    value = row["metric_value"]
-    unit = row["unit"]
-
-    if unit == "ms":
-        display = f"{value:,.2f} ms"
-    elif unit == "ratio":
-        display = f"{value:.3f}"
-    else:
-        display = f"{value:,.2f}" if float(value) % 1 else f"{int(value):,}"
-
-    column.metric(label=row["metric_label"], value=display)
+# Latency metrics are null when every retrieval came from the cache.
+displays = [
+    "n/a" if pd.isna(value) else _METRIC_FORMATTERS.get(unit, _format_count)(value)
+    for value, unit in zip(metrics_df["metric_value"].tolist(), metrics_df["unit"].tolist())
+]
+for index, (label, display) in enumerate(zip(metrics_df["metric_label"].tolist(), displays)):
+    card_columns[index % 4].metric(label=label, value=display)
 
 st.subheader("Metrics by Category")
-chart_df = metrics_df[["metric_label", "metric_value"]].set_index("metric_label")
-st.bar_chart(chart_df)
+st.bar_chart(pd.Series(metrics_df["metric_value"].to_numpy(), index=metrics_df["metric_label"].to_numpy()).dropna())
 
 st.subheader("Metrics Table")
 st.dataframe(metrics_df, use_container_width=True)
@@ -92,6 +119,7 @@ if not questions_df.empty:
         "is_refusal",
         "expected_keyword_coverage",
         "answer_context_overlap",
+        "retrieval_cached",
         "retrieval_latency_ms",
         "generation_latency_ms",
         "total_latency_ms",
@@ -100,7 +128,7 @@ if not questions_df.empty:
     st.dataframe(questions_df[available_columns], use_container_width=True)
 
     with st.expander("Show Generated Answers"):
-        for _, row in questions_df.iterrows():
+        for row in questions_df.to_dict("records"):
             st.markdown(f"**{row.get('id', '')}** - {row.get('question', '')}")
             st.caption(f"Expected source: {row.get('expected_source', 'n/a')}")
             st.write(row.get("answer", ""))
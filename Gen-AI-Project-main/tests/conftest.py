@@ -0,0 +1,8 @@
+import os
+import tempfile
+
+# app.config reads these when first imported, so point the Chroma store and the
+# embedding cache at a scratch directory before any test imports app modules.
+_TEST_DATA_DIR = tempfile.mkdtemp(prefix="rag-tests-")
+os.environ["CHROMA_PERSIST_DIRECTORY"] = os.path.join(_TEST_DATA_DIR, "chroma")
+os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(_TEST_DATA_DIR, "embeddings.sqlite")
@@ -0,0 +1,77 @@
+import pytest
+
+pytest.importorskip("chromadb")
+
+from app.chroma_store import store
+
+
+def _chat_with_messages(count: int) -> str:
+    chat_id = store.create_chat("user-1")["id"]
+    for index in range(count):
+        store.add_message(chat_id, "user-1", "user", f"m{index}", now=f"2026-01-01T00:00:{index:02d}")
+    return chat_id
+
+
+def _contents(messages: list[dict]) -> list[str]:
+    return [message["content"] for message in messages]
+
+
+def test_list_messages_returns_newest_in_order():
+    chat_id = _chat_with_messages(12)
+    store._messages_by_chat.clear()
+
+    assert _contents(store.list_messages(chat_id, limit=5)) == [f"m{index}" for index in range(7, 12)]
+    assert _contents(store.list_messages(chat_id)) == [f"m{index}" for index in range(12)]
+
+
+def test_limited_miss_caches_a_tail_that_add_message_extends():
+    chat_id = _chat_with_messages(12)
+    store._messages_by_chat.clear()
+
+    store.list_messages(chat_id, limit=5)
+    messages, complete = store._messages_by_chat[chat_id]
+    assert not complete and len(messages) == 5
+
+    store.add_message(chat_id, "user-1", "assistant", "m12", now="2026-01-01T00:00:12")
+    assert _contents(store.list_messages(chat_id, limit=5)) == [f"m{index}" for index in range(8, 13)]
+    # A longer read than the tail holds goes back to Chroma and caches the full list.
+    assert len(store.list_messages(chat_id, limit=10)) == 10
+    assert _contents(store.list_messages(chat_id)) == [f"m{index}" for index in range(13)]
+    assert store._messages_by_chat[chat_id][1]
+
+
+def test_cached_list_is_not_exposed_to_callers():
+    chat_id = _chat_with_messages(3)
+    store.list_messages(chat_id).append({"content": "mutated"})
+    assert _contents(store.list_messages(chat_id)) == ["m0", "m1", "m2"]
+
+
+class _MessagesWithConcurrentWrite:
+    # Runs add_message while list_messages is reading outside the cache lock.
+    def __init__(self, collection, chat_id):
+        self._collection = collection
+        self._chat_id = chat_id
+        self._written = False
+
+    def get(self, *args, **kwargs):
+        data = self._collection.get(*args, **kwargs)
+        if not self._written:
+            self._written = True
+            store.add_message(self._chat_id, "user-1", "user", "late", now="2026-01-01T00:01:00")
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+
+@pytest.mark.parametrize("limit", [None, 2])
+def test_list_messages_racing_add_message_is_not_cached(monkeypatch, limit):
+    chat_id = _chat_with_messages(3)
+    store._messages_by_chat.clear()
+
+    monkeypatch.setattr(store, "messages", _MessagesWithConcurrentWrite(store.messages, chat_id))
+    store.list_messages(chat_id, limit=limit)
+    monkeypatch.undo()
+
+    assert chat_id not in store._messages_by_chat
+    assert _contents(store.list_messages(chat_id))[-1] == "late"
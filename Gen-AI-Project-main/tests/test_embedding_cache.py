@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from app.embedding_cache import EMBEDDING_DTYPES, EmbeddingCache, dequantize, quantize
+
+
+def _vector(seed: int = 0, size: int = 64) -> list[float]:
+    return np.random.default_rng(seed).standard_normal(size).tolist()
+
+
+def test_fp32_round_trip_is_exact():
+    vec = np.asarray(_vector(), dtype=np.float32)
+    np.testing.assert_array_equal(dequantize(quantize(vec, "fp32"), "fp32"), vec)
+
+
+def test_fp16_round_trip_is_close():
+    vec = np.asarray(_vector(), dtype=np.float32)
+    restored = dequantize(quantize(vec, "fp16"), "fp16")
+    assert restored.dtype == np.float32
+    np.testing.assert_allclose(restored, vec, rtol=1e-3, atol=1e-3)
+
+
+def test_int8_round_trip_is_within_half_a_step():
+    vec = np.asarray(_vector(), dtype=np.float32)
+    blob = quantize(vec, "int8")
+    assert len(blob) == 4 + vec.size
+    scale = np.abs(vec).max() / 127
+    assert np.abs(dequantize(blob, "int8") - vec).max() <= scale / 2 + 1e-6
+
+
+def test_int8_zero_vector_round_trips():
+    zeros = np.zeros(8, dtype=np.float32)
+    np.testing.assert_array_equal(dequantize(quantize(zeros, "int8"), "int8"), zeros)
+
+
+def test_unknown_dtype_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        EmbeddingCache(str(tmp_path / "cache.sqlite"), "model", dtype="bf16")
+
+
+@pytest.mark.parametrize("dtype", EMBEDDING_DTYPES)
+def test_miss_and_later_hits_return_the_same_vector(tmp_path, dtype):
+    path = str(tmp_path / "cache.sqlite")
+    cache = EmbeddingCache(path, "model", dtype=dtype)
+    key = cache.key("hello")
+    assert cache.get_many([key]) == {}
+
+    stored = cache.put_many([(key, _vector(1))])[0]
+    assert cache.get_many([key])[key] == stored
+
+    # A fresh instance has an empty memory tier, so this hit decodes the SQLite blob.
+    reopened = EmbeddingCache(path, "model", dtype=dtype)
+    assert reopened.get_many([key])[key] == stored
+
+
+def test_key_depends_on_model_and_dtype(tmp_path):
+    fp32 = EmbeddingCache(str(tmp_path / "a.sqlite"), "model", dtype="fp32")
+    int8 = EmbeddingCache(str(tmp_path / "b.sqlite"), "model", dtype="int8")
+    other = EmbeddingCache(str(tmp_path / "c.sqlite"), "other-model", dtype="fp32")
+    assert len({fp32.key("text"), int8.key("text"), other.key("text")}) == 3
+
+
+def test_memory_tier_is_bounded(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"), "model", memory_items=2)
+    keys = [cache.key(str(index)) for index in range(3)]
+    cache.put_many([(key, _vector(index)) for index, key in enumerate(keys)])
+    assert list(cache._memory) == keys[1:]
+    # Evicted entries are still served from SQLite.
+    assert set(cache.get_many(keys)) == set(keys)
@@ -0,0 +1,26 @@
+import pytest
+
+pytest.importorskip("chromadb")
+pytest.importorskip("openai")
+
+from scripts.evaluate_rag import _metric, _p95
+
+
+def test_p95_of_empty_is_zero():
+    assert _p95([]) == 0.0
+
+
+def test_p95_of_single_value():
+    assert _p95([42.0]) == 42.0
+
+
+def test_p95_uses_nearest_rank():
+    values = list(range(1, 101))
+    assert _p95(values) == 95.0
+    assert _p95(list(reversed(values))) == 95.0
+    assert _p95([1.0, 2.0, 3.0]) == 3.0
+
+
+def test_metric_keeps_missing_values_null():
+    assert _metric("key", "Label", None, "ms", "latency")["metric_value"] is None
+    assert _metric("key", "Label", 3, "count", "overview")["metric_value"] == 3.0
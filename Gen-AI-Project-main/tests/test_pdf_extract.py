@@ -0,0 +1,39 @@
+import random
+
+import pytest
+
+pytest.importorskip("pypdfium2")
+
+from scripts.pdf_extract import iter_chunks
+
+
+def _split_text(text: str, chunk_size: int = 1000, overlap: int = 150) -> list[str]:
+    # The join-then-split chunker iter_chunks replaced.
+    step = chunk_size - overlap
+    text = text.strip()
+    if not text:
+        return []
+    stop = max(len(text) - overlap, 1)
+    chunks = [text[start : start + chunk_size] for start in range(0, stop, step)]
+    return [chunk for chunk in chunks if not chunk.isspace()]
+
+
+@pytest.mark.parametrize("chunk_size,overlap", [(1000, 150), (10, 3), (7, 0), (50, 49)])
+def test_iter_chunks_matches_split_text(chunk_size, overlap):
+    rng = random.Random(chunk_size * 100 + overlap)
+    for _ in range(300):
+        pages = [
+            "".join(rng.choice("ab \n") for _ in range(rng.randint(0, 2500)))
+            for _ in range(rng.randint(0, 6))
+        ]
+        expected = _split_text("\n".join(page.strip() for page in pages if page.strip()), chunk_size, overlap)
+        assert list(iter_chunks(pages, chunk_size, overlap)) == expected
+
+
+def test_iter_chunks_skips_blank_pages():
+    assert list(iter_chunks(["", "  \n ", "\thello  "], chunk_size=10, overlap=2)) == ["hello"]
+
+
+def test_iter_chunks_rejects_overlap_not_below_chunk_size():
+    with pytest.raises(ValueError):
+        list(iter_chunks(["text"], chunk_size=10, overlap=10))